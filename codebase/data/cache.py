@@ -0,0 +1,131 @@
+import os
+import shutil
+import weakref
+from pathlib import Path
+from typing import Any, Tuple, Union
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+class CachedDataset(Dataset):
+    """
+    Memoizes the samples of a dataset with deterministic transforms into memory-mapped files.
+
+    Each sample is computed by the wrapped dataset on first access and written with a fixed stride into
+    a single file (typically on the `/dev/shm` RAM disk), later accesses read it back from the mapping.
+    The files are shared by all DataLoader workers and are removed by `cleanup`, or when the dataset is
+    garbage collected or the interpreter exits, so that a failed or interrupted run does not leak them.
+
+    Args:
+        dataset (Dataset): Dataset returning `(image, target)` pairs of fixed shapes.
+        cache_dir (Union[str, Path]): Directory holding the cache files, created if missing.
+    """
+    def __init__(
+        self,
+        dataset: Dataset,
+        cache_dir: Union[str, Path],
+    ):
+        self.dataset = dataset
+        self.cache_dir = Path(cache_dir)
+
+        # Infer the layout of the cache from the first sample
+        image, target = dataset[0]
+        image, target = torch.as_tensor(image).numpy(), np.asarray(target)
+        self.layout = {
+            "images": (image.dtype, image.shape),
+            "targets": (target.dtype, target.shape),
+            "cached": (np.dtype(np.bool_), ()),
+        }
+
+        # Also called on garbage collection and at exit, when a failed run never reaches `teardown`
+        self._finalizer = weakref.finalize(self, _remove_cache, self.cache_dir, os.getpid())
+
+        # Files are recreated empty, so that samples left over by an earlier cache are never served
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for name, (dtype, shape) in self.layout.items():
+            size = len(dataset) * dtype.itemsize * int(np.prod(shape))
+            with open(self.cache_dir / f"{name}.bin", "wb") as f:
+                f.truncate(size)
+
+        # Opened lazily so that each worker maps the files itself
+        self.memmaps = None
+
+    def __getstate__(self) -> dict:
+        # Spawned workers receive the dataset without the finalizer, which stays with the main process
+        state = self.__dict__.copy()
+        state.pop("_finalizer", None)
+        return state
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, Any]:
+        if self.memmaps is None:
+            self.memmaps = {
+                name: np.memmap(
+                    self.cache_dir / f"{name}.bin",
+                    dtype=dtype,
+                    mode="r+",
+                    shape=(len(self.dataset), *shape),
+                )
+                for name, (dtype, shape) in self.layout.items()
+            }
+
+        if not self.memmaps["cached"][index]:
+            image, target = self.dataset[index]
+            self.memmaps["images"][index] = torch.as_tensor(image).numpy()
+            self.memmaps["targets"][index] = np.asarray(target)
+            self.memmaps["cached"][index] = True
+
+        image = torch.from_numpy(np.array(self.memmaps["images"][index]))
+        target = torch.from_numpy(np.array(self.memmaps["targets"][index]))
+
+        return image, target
+
+    def cleanup(self) -> None:
+        """Remove the cache files."""
+        self.memmaps = None
+        self._finalizer()
+
+
+def _remove_cache(cache_dir: Path, pid: int) -> None:
+    """Remove a cache directory, only from the process that created it (forked workers inherit the finalizer)."""
+    if os.getpid() == pid:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class MemmapDataset(Dataset):
+    """
+    Dataset reading preprocessed samples from `.npy` files through a memory mapping.
+
+    Args:
+        images_path (Union[str, Path]): `.npy` file with the `(N, C, H, W)` images.
+        targets_path (Union[str, Path]): `.npy` file with the `(N, ...)` targets.
+    """
+    def __init__(
+        self,
+        images_path: Union[str, Path],
+        targets_path: Union[str, Path],
+    ):
+        self.images_path = Path(images_path)
+        self.targets_path = Path(targets_path)
+        self.length = len(np.load(self.images_path, mmap_mode="r"))
+
+        # Opened lazily so that each worker maps the files itself
+        self.images = None
+        self.targets = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.images is None:
+            self.images = np.load(self.images_path, mmap_mode="r")
+            self.targets = np.load(self.targets_path, mmap_mode="r")
+
+        image = torch.from_numpy(np.array(self.images[index]))
+        target = torch.from_numpy(np.array(self.targets[index]))
+
+        return image, target
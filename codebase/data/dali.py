@@ -0,0 +1,135 @@
+import math
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import torch
+from nvidia.dali import fn, pipeline_def, types
+from nvidia.dali.plugin.pytorch import DALIGenericIterator, LastBatchPolicy
+from torchvision import datasets
+
+
+class LSUNSource:
+    """
+    Iterable yielding batches of encoded images and class indices read from the LMDB databases of LSUN.
+
+    Args:
+        dataset (datasets.LSUN): LSUN dataset whose databases are read.
+        batch_size (int): Number of samples per batch.
+        shuffle (bool): Whether to shuffle the samples at every epoch.
+        shard_id (int): Index of the shard read by this process.
+        num_shards (int): Total number of shards, usually the world size.
+        seed (int): Seed of the shuffling, which must be the same on all shards.
+    """
+    def __init__(
+        self,
+        dataset: datasets.LSUN,
+        batch_size: int,
+        shuffle: bool = False,
+        shard_id: int = 0,
+        num_shards: int = 1,
+        seed: int = 0,
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.seed = seed
+        self.epoch = 0
+        self.offsets = np.array([0] + dataset.indices[:-1])
+
+    def __len__(self) -> int:
+        return len(range(self.shard_id, len(self.dataset), self.num_shards))
+
+    def __iter__(self) -> "LSUNSource":
+        # Like `DistributedSampler`, every shard draws the same permutation, so that the shards are disjoint
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(len(self.dataset))
+        else:
+            order = np.arange(len(self.dataset))
+        self.epoch += 1
+        self.order = order[self.shard_id::self.num_shards]
+        self.position = 0
+        return self
+
+    def __next__(self) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        if self.position >= len(self.order):
+            raise StopIteration
+        indices = self.order[self.position: self.position + self.batch_size]
+        self.position += self.batch_size
+
+        data, labels = [], []
+        for index in indices:
+            target = int(np.searchsorted(self.dataset.indices, index, side="right"))
+            db = self.dataset.dbs[target]
+            with db.env.begin(write=False) as txn:
+                buffer = txn.get(db.keys[index - self.offsets[target]])
+            data.append(np.frombuffer(buffer, dtype=np.uint8))
+            labels.append(np.array([target], dtype=np.int64))
+        return data, labels
+
+
+@pipeline_def
+def lsun_pipeline(source: LSUNSource, img_size: int):
+    """
+    Decode, resize the shorter side and center crop LSUN images.
+
+    LSUN stores WebP images, which the mixed decoder has no GPU path for: they are decoded on the CPU by
+    the pipeline threads, and only resized and cropped on the GPU.
+    """
+    data, labels = fn.external_source(source=source, num_outputs=2, batch=True, dtype=[types.UINT8, types.INT64])
+    images = fn.decoders.image(data, device="mixed", output_type=types.RGB)
+    images = fn.resize(images, resize_shorter=img_size, antialias=True)
+    images = fn.crop(images, crop=(img_size, img_size))
+    return images, labels.gpu()
+
+
+class DALILoader:
+    """
+    Iterates over a DALI LSUN pipeline and yields `(images, labels)` batches like a DataLoader.
+
+    Images are returned as uint8 `(N, C, H, W)` tensors in channels-last memory format on the GPU.
+    """
+    def __init__(
+        self,
+        dataset: datasets.LSUN,
+        img_size: int,
+        batch_size: int,
+        device_id: int,
+        num_threads: int = 4,
+        shuffle: bool = False,
+        shard_id: int = 0,
+        num_shards: int = 1,
+        seed: int = 0,
+    ):
+        self.source = LSUNSource(
+            dataset,
+            batch_size,
+            shuffle=shuffle,
+            shard_id=shard_id,
+            num_shards=num_shards,
+            seed=seed,
+        )
+        self.batch_size = batch_size
+        pipeline = lsun_pipeline(
+            source=self.source,
+            img_size=img_size,
+            batch_size=batch_size,
+            num_threads=num_threads,
+            device_id=device_id,
+        )
+        self.iterator = DALIGenericIterator(
+            pipeline,
+            ["images", "labels"],
+            auto_reset=True,
+            last_batch_policy=LastBatchPolicy.PARTIAL,
+        )
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.source) / self.batch_size)
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+        for outputs in self.iterator:
+            images, labels = outputs[0]["images"], outputs[0]["labels"]
+            # NHWC -> NCHW view, which keeps the channels-last memory layout
+            yield images.permute(0, 3, 1, 2), labels.squeeze(-1)
@@ -1,35 +1,145 @@
+import os
+import shutil
+from collections import namedtuple
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import pytorch_lightning as pl
 import torch
-from torch.utils.data import DataLoader, random_split
-from torchvision import datasets, transforms
+import torch.nn.functional as F
+from lightning_fabric.utilities.seed import pl_worker_init_function
+from pytorch_lightning.utilities import rank_zero_warn
+from torch.utils.data import (
+    DataLoader,
+    Dataset,
+    DistributedSampler,
+    Subset,
+    default_collate,
+    get_worker_info,
+    random_split,
+)
+from torchvision import datasets
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms import v2
+from torchvision.transforms.v2 import functional as TF
 from tqdm import tqdm
 
+from codebase.data.cache import CachedDataset, MemmapDataset
+from codebase.data.encoded import EncodedCelebA, EncodedFlowers102, encoded_collate
+from codebase.data.prefetcher import CudaPrefetcher
+from codebase.data.shared import SharedCelebA, SharedFlowers102
 from isprs import ISPRSDataset
 from massroads import MassDataset
 from data.dataLoader import SEN12MSCR
-from utils.path import DATASET_PATH
-
-
-class CenterCropMinXY(object):
+from utils.lightning_utils import configure_num_workers
+from utils.path import CACHE_PATH, DATASET_PATH
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Supported datasets. `crop_size` is the side of the center-cropped images for the datasets whose images
+# all have the same size, which can be resized batch-wise when training on a CUDA device
+_DatasetSpec = namedtuple("_DatasetSpec", ["img_channels", "crop_size"])
+_DATASET_SPECS = {
+    "MNIST": _DatasetSpec(img_channels=1, crop_size=28),
+    "CelebA": _DatasetSpec(img_channels=3, crop_size=178),
+    "LSUN": _DatasetSpec(img_channels=3, crop_size=None),
+    "Flowers102": _DatasetSpec(img_channels=3, crop_size=None),
+    "SEN12MSCR": _DatasetSpec(img_channels=3, crop_size=None),
+    "MassRoads": _DatasetSpec(img_channels=3, crop_size=None),
+    "ISPRS": _DatasetSpec(img_channels=3, crop_size=None),
+}
+
+# Input sizes are fixed per dataset, so let cuDNN pick the fastest (channels-last) kernels
+torch.backends.cudnn.benchmark = True
+
+
+class CenterCropMinXY(v2.Transform):
     """
     Custom transform that performs a center crop on the image in the smaller dimension (X or Y).
     """
-    def __call__(self, image):
-        assert type(image) == torch.Tensor
-        # Get the height and width of the image
-        _, h, w = image.shape
-        # Determine the smaller dimension
+    def _transform(self, inpt: Any, params: Dict[str, Any]) -> Any:
+        # Crop a square of the smaller dimension out of the center of the image
+        h, w = TF.get_size(inpt)
         min_dim = min(h, w)
-        # Calculate top and left coordinates for cropping
         top = (h - min_dim) // 2
         left = (w - min_dim) // 2
-        # Perform the crop
-        image = image[:, top: top + min_dim, left: left + min_dim]
-        # Update the sample dictionary
-        return image
+        return TF.crop(inpt, top, left, min_dim, min_dim)
+
+
+def device_transform(x: torch.Tensor, img_size: int, flip: bool = False) -> torch.Tensor:
+    """
+    Batch-wise transforms run on the training device on `(N, C, H, W)` images: convert them to float in
+    channels-last memory format, resize to `img_size` if needed, normalize to [-1, 1] and, if `flip`,
+    horizontally flip each image with probability 0.5.
+    """
+    is_uint8 = x.dtype == torch.uint8
+    # A single copy for both the dtype cast and the memory layout
+    x = x.to(torch.float32, memory_format=torch.channels_last)
+    # Images of fixed-size datasets may reach this point cropped but not resized when training on CUDA
+    if x.shape[-2:] != (img_size, img_size):
+        x = F.interpolate(x, size=(img_size, img_size), mode="bilinear", antialias=True)
+
+    # Single in-place pass; float inputs (e.g. SEN12MSCR sensor data) are already in [0, 1]
+    if is_uint8:
+        x = x.sub_(127.5).div_(127.5)
+    else:
+        x = x.sub_(0.5).mul_(2.0)
+
+    if flip:
+        # One Bernoulli draw per image and a single flip kernel for the whole batch
+        mask = torch.rand(x.size(0), device=x.device) < 0.5
+        x = torch.where(mask[:, None, None, None], x.flip(-1), x)
+    return x
+
+
+def worker_init_fn(worker_id: int, rank: Optional[int] = None) -> None:
+    """
+    Disable OpenCV multithreading in DataLoader workers, which otherwise oversubscribes the CPU.
+
+    Replaces Lightning's worker init function, so the workers are also seeded the way Lightning does it
+    when `seed_everything(workers=True)` was called.
+    """
+    if int(os.environ.get("PL_SEED_WORKERS", 0)):
+        pl_worker_init_function(worker_id, rank=rank)
+    cv2.setNumThreads(0)
+
+
+def _process_alive(pid: int) -> bool:
+    """Return whether a process with the given pid is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Owned by another user
+        pass
+    return True
+
+
+def fast_collate(samples: Sequence[Tuple[torch.Tensor, Any]]) -> Tuple[torch.Tensor, Any]:
+    """
+    Collate function that copies the images into a single preallocated tensor of their own dtype.
+
+    Keeping uint8 images as uint8 moves 4x fewer bytes through pinned memory and the host-to-device
+    copy than float32; the conversion happens on the training device.
+    """
+    images, targets = zip(*samples)
+    shape = (len(images), *images[0].shape)
+    if get_worker_info() is not None:
+        # Like `default_collate`, allocate straight in shared memory, so that sending the batch to the
+        # main process does not copy it there
+        storage = images[0]._typed_storage()._new_shared(len(images) * images[0].numel(), device=images[0].device)
+        batch = images[0].new(storage).resize_(shape)
+    else:
+        batch = torch.empty(shape, dtype=images[0].dtype)
+    for i, image in enumerate(images):
+        batch[i].copy_(image)
+    return batch, default_collate(targets)
 
 
 class DataModule(pl.LightningDataModule):
@@ -40,61 +150,84 @@ class DataModule(pl.LightningDataModule):
         img_channels: int,
         data_dir: Union[str, Path] = DATASET_PATH,
         batch_size: int = 32,
-        num_workers: int = 0,
+        num_workers: Optional[int] = None,
+        prefetch_factor: int = 4,
         pin_memory: bool = True,
         persistent_workers: bool = True,
         train_val_split: float = 0.8,
         download: bool = True,
+        gpu_decode: bool = False,
+        cuda_prefetch: bool = False,
+        cache: bool = False,
+        precompute: bool = False,
+        dali: bool = False,
+        compile_transforms: bool = False,
     ):
         super().__init__()
         self.name = str(name)
         self.data_dir = data_dir
         self.img_size = img_size
         self.img_channels = img_channels
-        self.batch_size = int(batch_size / (torch.cuda.device_count() if torch.cuda.device_count() > 1 else 1))
-        self.num_workers = num_workers
+        self.batch_size = self._per_device_batch_size(batch_size)
+        self.num_workers = configure_num_workers() if num_workers is None else num_workers
+        self.prefetch_factor = prefetch_factor if self.num_workers > 0 else None
         self.pin_memory = pin_memory
         self.persistent_workers = persistent_workers
         self.train_val_split = train_val_split
         self.download = download
+        self.gpu_decode = gpu_decode
+        self.cuda_prefetch = cuda_prefetch
+        self.cache = cache
+        self.precompute = precompute
+        self.dali = dali
+        self.compile_transforms = compile_transforms
+        self.device_transform = device_transform
 
         self.sanity_check()
-        self.transforms = {
-            "train": transforms.Compose(
-                [
-                    transforms.ToTensor(),
-                    transforms.Normalize(
-                        [0.5] * self.img_channels,
-                        [0.5] * self.img_channels,
-                    ),
-                    CenterCropMinXY(),
-                    transforms.Resize(self.img_size, antialias=True),
-                    transforms.RandomHorizontalFlip(0.5),
-                ]
-            ),
-            "val": transforms.Compose(
-                [
-                    transforms.ToTensor(),
-                    transforms.Normalize(
-                        [0.5] * self.img_channels,
-                        [0.5] * self.img_channels,
-                    ),
-                    CenterCropMinXY(),
-                    transforms.Resize(self.img_size, antialias=True),
-                ]
-            ),
-            "test": transforms.Compose(
-                [
-                    transforms.ToTensor(),
-                    transforms.Normalize(
-                        [0.5] * self.img_channels,
-                        [0.5] * self.img_channels,
-                    ),
-                    CenterCropMinXY(),
-                    transforms.Resize(self.img_size, antialias=True),
-                ]
-            ),
-        }
+
+    @staticmethod
+    def _per_device_batch_size(batch_size: int) -> int:
+        """
+        Split the batch size across the GPUs, rounding it up to a multiple of 8 on CUDA devices so that
+        half-precision convolutions and GEMMs run on Tensor Cores. Batches smaller than 8 are kept as is,
+        since they are usually chosen to fit the memory.
+        """
+        per_device = max(1, batch_size // max(1, torch.cuda.device_count()))
+        if torch.cuda.is_available() and per_device >= 8 and per_device % 8 != 0:
+            aligned = (per_device + 7) // 8 * 8
+            rank_zero_warn(
+                f"Per-device batch size {per_device} is rounded up to {aligned} for Tensor Core alignment."
+            )
+            per_device = aligned
+        return per_device
+
+    @cached_property
+    def transform(self) -> v2.Compose:
+        """
+        Sample transform shared by all splits, built on first access.
+
+        Samples stay uint8 (or their native dtype) on the workers, and are converted to float,
+        normalized and (for training) randomly flipped batch-wise on the training device in
+        `on_after_batch_transfer`. Only the deterministic crop and resize are left here. When training
+        on a CUDA device, datasets whose images all have the same size and are upsampled (e.g. MNIST at
+        32 px) are only cropped here, and resized together with the rest of the batch. Downsampled images
+        are still resized here, so that no more than `img_size` pixels per image are copied to the device.
+        On CPU the resize stays in the parallel workers, and on MPS the antialiased interpolation is not
+        always available.
+        """
+        transforms = [v2.ToImage(), CenterCropMinXY()]
+        device = self.trainer.strategy.root_device if self.trainer is not None else None
+        crop_size = _DATASET_SPECS[self.name].crop_size
+        resize_on_device = (
+            crop_size is not None
+            and crop_size <= self.img_size
+            and not self.precompute
+            and device is not None
+            and device.type == "cuda"
+        )
+        if not resize_on_device:
+            transforms.append(v2.Resize(self.img_size, antialias=True))
+        return v2.Compose(transforms)
 
     def prepare_data(self) -> None:
         """Download the data."""
@@ -119,23 +252,38 @@ class DataModule(pl.LightningDataModule):
             ):
                 datasets.Flowers102(self.data_dir, split=split, download=self.download)
 
+        if self.precompute:
+            for split, dataset in self._raw_datasets().items():
+                images_path, targets_path = self._precomputed_paths(split)
+                if not images_path.exists():
+                    self._precompute(dataset, images_path, targets_path, desc=f"Preprocessing {self.name} {split} split")
+
     def setup(self, stage: Optional[str] = None) -> None:
         """Setup datasets for training, validation, and testing."""
-        if self.name == "MNIST":
+        if self.compile_transforms:
+            # Fuse the elementwise conversion, normalization and flip into a single kernel
+            self.device_transform = torch.compile(device_transform, dynamic=False)
+
+        if self.precompute:
+            self.train_dataset = MemmapDataset(*self._precomputed_paths("train"))
+            self.val_dataset = MemmapDataset(*self._precomputed_paths("val"))
+            self.test_dataset = MemmapDataset(*self._precomputed_paths("test"))
+
+        elif self.name == "MNIST":
+            # All splits share the same transform, so train and val are subsets of one dataset
             full_train_dataset = datasets.MNIST(
                 self.data_dir,
                 train=True,
-                transform=self.transforms["train"],
+                transform=self.transform,
             )
             num_train = int(len(full_train_dataset) * self.train_val_split)
-            num_val = len(full_train_dataset) - num_train
-            self.train_dataset, self.val_dataset = random_split(
-                full_train_dataset, [num_train, num_val]
-            )
+            indices = torch.randperm(len(full_train_dataset)).tolist()
+            self.train_dataset = Subset(full_train_dataset, indices[:num_train])
+            self.val_dataset = Subset(full_train_dataset, indices[num_train:])
             self.test_dataset = datasets.MNIST(
                 self.data_dir,
                 train=False,
-                transform=self.transforms["test"],
+                transform=self.transform,
             )
 
         elif self.name == "LSUN":
@@ -148,54 +296,57 @@ class DataModule(pl.LightningDataModule):
             self.train_dataset = datasets.LSUN(
                 root=self.data_dir / "LSUN",
                 classes=train_classes,
-                transform=self.transforms["train"],
+                transform=self.transform,
             )
             self.val_dataset = datasets.LSUN(
                 root=self.data_dir / "LSUN",
                 classes=val_classes,
-                transform=self.transforms["val"],
+                transform=self.transform,
             )
             self.test_dataset = datasets.LSUN(
                 root=self.data_dir / "LSUN",
                 classes=test_classes,
-                transform=self.transforms["test"],
+                transform=self.transform,
             )
 
         elif self.name == "CelebA":
-            self.train_dataset = datasets.CelebA(
+            # Encoded images are decoded and transformed batch-wise in `on_before_batch_transfer`
+            dataset_cls = EncodedCelebA if self.gpu_decode else SharedCelebA
+            self.train_dataset = dataset_cls(
                 self.data_dir,
                 split="train",
                 target_type="attr",
-                transform=self.transforms["train"],
+                transform=self.transform,
             )
-            self.val_dataset = datasets.CelebA(
+            self.val_dataset = dataset_cls(
                 self.data_dir,
                 split="valid",
                 target_type="attr",
-                transform=self.transforms["val"],
+                transform=self.transform,
             )
-            self.test_dataset = datasets.CelebA(
+            self.test_dataset = dataset_cls(
                 self.data_dir,
                 split="test",
                 target_type="attr",
-                transform=self.transforms["test"],
+                transform=self.transform,
             )
 
         elif self.name == "Flowers102":
-            self.train_dataset = datasets.Flowers102(
+            dataset_cls = EncodedFlowers102 if self.gpu_decode else SharedFlowers102
+            self.train_dataset = dataset_cls(
                 self.data_dir,
                 split="train",
-                transform=self.transforms["train"],
+                transform=self.transform,
             )
-            self.val_dataset = datasets.Flowers102(
+            self.val_dataset = dataset_cls(
                 self.data_dir,
                 split="val",
-                transform=self.transforms["val"],
+                transform=self.transform,
             )
-            self.test_dataset = datasets.Flowers102(
+            self.test_dataset = dataset_cls(
                 self.data_dir,
                 split="test",
-                transform=self.transforms["test"],
+                transform=self.transform,
             )
 
         elif self.name == "SEN12MSCR":
@@ -203,19 +354,19 @@ class DataModule(pl.LightningDataModule):
             self.train_dataset = SEN12MSCR(
                 root=self.data_dir,
                 split="train",
-                transform=self.transforms["train"]
+                transform=self.transform
             )
 
             self.val_dataset = SEN12MSCR(
                 root=self.data_dir,
                 split="val",
-                transform=self.transforms["val"]
+                transform=self.transform
             )
 
             self.test_dataset = SEN12MSCR(
                 root=self.data_dir,
                 split="test",
-                transform=self.transforms["test"]
+                transform=self.transform
             )
 
         elif self.name == "MassRoads":
@@ -224,78 +375,256 @@ class DataModule(pl.LightningDataModule):
                 data_dir=self.data_dir,
                 dataset='roads',
                 split='train',
-                transform=self.transforms["train"]
+                transform=self.transform
             )
 
             self.val_dataset = MassDataset(
                 data_dir=self.data_dir,
                 dataset='roads',
                 split='valid',
-                transform=self.transforms["val"]
+                transform=self.transform
             )
 
             self.test_dataset = MassDataset(
                 data_dir=self.data_dir,
                 dataset='roads',
                 split='test',
-                transform=self.transforms["test"]
+                transform=self.transform
             )
 
         elif self.name == "ISPRS":
 
+            # All splits share the same transform, so train and val are subsets of one dataset
             full_train_dataset = ISPRSDataset(
                 data_dir=self.data_dir,
-                is_train=True
+                is_train=True,
+                transform=self.transform
             )
 
             train_size = self.train_val_split
             valid_size = 1.0 - train_size
 
-            self.train_dataset, self.val_dataset = random_split(
-                full_train_dataset, [train_size, valid_size]
+            train_indices, val_indices = random_split(
+                range(len(full_train_dataset)), [train_size, valid_size]
             )
 
-            self.train_dataset.dataset.transform = self.transforms["train"]
-            self.val_dataset.dataset.transform = self.transforms["val"]
+            self.train_dataset = Subset(full_train_dataset, train_indices.indices)
+            self.val_dataset = Subset(full_train_dataset, val_indices.indices)
 
             self.test_dataset = ISPRSDataset(
                 self.data_dir,
                 is_train=False,
-                transform=self.transforms["test"]
+                transform=self.transform
             )
 
-    def train_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.train_dataset,
+        if self.cache:
+            self.train_dataset = self._cached(self.train_dataset, "train")
+            self.val_dataset = self._cached(self.val_dataset, "val")
+            self.test_dataset = self._cached(self.test_dataset, "test")
+
+    def teardown(self, stage: Optional[str] = None) -> None:
+        """Remove the cache files of the datasets."""
+        if self.cache:
+            for dataset in (self.train_dataset, self.val_dataset, self.test_dataset):
+                dataset.cleanup()
+
+    def _cached(self, dataset: Dataset, split: str) -> CachedDataset:
+        """Wrap a split in a `CachedDataset` stored on the RAM disk, unique to this process."""
+        prefix = f"{self.name}_{self.img_size}_{split}_"
+        # Remove the caches of killed runs (e.g. SIGKILL), which could not clean up after themselves
+        for cache_dir in CACHE_PATH.glob(f"{prefix}*"):
+            pid = cache_dir.name[len(prefix):]
+            if pid.isdigit() and not _process_alive(int(pid)):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+
+        return CachedDataset(dataset, CACHE_PATH / f"{prefix}{os.getpid()}")
+
+    def _raw_datasets(self) -> Dict[str, Dataset]:
+        """Return the splits of the dataset with the deterministic (crop and resize) transforms only."""
+        if self.name == "CelebA":
+            return {
+                split: datasets.CelebA(
+                    self.data_dir,
+                    split=celeba_split,
+                    target_type="attr",
+                    transform=self.transform,
+                )
+                for split, celeba_split in [("train", "train"), ("val", "valid"), ("test", "test")]
+            }
+
+        elif self.name == "LSUN":
+            # LSUN has no test split, its test set is the val split (see `_precomputed_paths`)
+            classes = ["bedroom"]
+            return {
+                split: datasets.LSUN(
+                    root=self.data_dir / "LSUN",
+                    classes=[f"{sub_class}_{lsun_split}" for sub_class in classes],
+                    transform=self.transform,
+                )
+                for split, lsun_split in [("train", "train"), ("val", "val")]
+            }
+
+    def _precomputed_paths(self, split: str) -> Tuple[Path, Path]:
+        """Return the paths of the precomputed images and targets of a split."""
+        if self.name == "LSUN" and split == "test":
+            split = "val"
+        prefix = f"{self.name}_{self.img_size}_{split}"
+        return (
+            Path(self.data_dir) / f"{prefix}_images.npy",
+            Path(self.data_dir) / f"{prefix}_targets.npy",
+        )
+
+    def _precompute(self, dataset: Dataset, images_path: Path, targets_path: Path, desc: str) -> None:
+        """Write the transformed samples of a dataset into contiguous `.npy` files."""
+        dataloader = DataLoader(
+            dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
-            persistent_workers=self.persistent_workers,
-            shuffle=True,
+            worker_init_fn=worker_init_fn if cv2 is not None else None,
+            collate_fn=fast_collate,
         )
+        tmp_images_path = images_path.with_suffix(".tmp.npy")
+        tmp_targets_path = targets_path.with_suffix(".tmp.npy")
+
+        images, targets, offset = None, None, 0
+        for x, y in tqdm(dataloader, desc=desc):
+            x, y = x.numpy(), torch.as_tensor(y).numpy()
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    tmp_images_path, mode="w+", dtype=x.dtype, shape=(len(dataset), *x.shape[1:])
+                )
+                targets = np.lib.format.open_memmap(
+                    tmp_targets_path, mode="w+", dtype=y.dtype, shape=(len(dataset), *y.shape[1:])
+                )
+            images[offset: offset + len(x)] = x
+            targets[offset: offset + len(y)] = y
+            offset += len(x)
+
+        images.flush()
+        targets.flush()
+        # The images file is moved last, as its existence marks the split as precomputed
+        os.replace(tmp_targets_path, targets_path)
+        os.replace(tmp_images_path, images_path)
+
+    def train_dataloader(self) -> Union[DataLoader, CudaPrefetcher]:
+        if self.dali:
+            return self._dali_dataloader()
+        return self._dataloader(self.train_dataset, shuffle=True)
+
+    def val_dataloader(self) -> Union[DataLoader, CudaPrefetcher]:
+        return self._dataloader(self.val_dataset)
+
+    def test_dataloader(self) -> Union[DataLoader, CudaPrefetcher]:
+        return self._dataloader(self.test_dataset)
+
+    def _dataloader(self, dataset: Dataset, shuffle: bool = False) -> Union[DataLoader, CudaPrefetcher]:
+        """Build the DataLoader of a split, wrapped in a `CudaPrefetcher` if enabled on a CUDA device."""
+        device = self.trainer.strategy.root_device if self.trainer is not None else None
+        prefetch = self.cuda_prefetch and device is not None and device.type == "cuda"
+
+        # Lightning only injects a distributed sampler into plain DataLoaders
+        sampler = None
+        if prefetch and self.trainer.world_size > 1:
+            sampler = DistributedSampler(
+                dataset,
+                num_replicas=self.trainer.world_size,
+                rank=self.trainer.global_rank,
+                shuffle=shuffle,
+            )
 
-    def val_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.val_dataset,
+        dataloader = DataLoader(
+            dataset,
             batch_size=self.batch_size,
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
-            persistent_workers=self.persistent_workers,
+            persistent_workers=self.persistent_workers and self.num_workers > 0,
+            prefetch_factor=self.prefetch_factor,
+            # Only set when needed, since Lightning skips its own worker seeding if a function is given
+            worker_init_fn=(
+                partial(worker_init_fn, rank=self.trainer.global_rank if self.trainer is not None else None)
+                if cv2 is not None
+                else None
+            ),
+            collate_fn=encoded_collate if self.gpu_decode else fast_collate,
+            sampler=sampler,
+            shuffle=shuffle if sampler is None else False,
         )
+        if prefetch:
+            return CudaPrefetcher(dataloader, device, num_prefetch_batches=2)
+        return dataloader
+
+    def _dali_dataloader(self):
+        """Build a DALI loader decoding the LSUN train split in its threads and cropping it on the GPU."""
+        from codebase.data.dali import DALILoader
 
-    def test_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.test_dataset,
+        return DALILoader(
+            self.train_dataset,
+            img_size=self.img_size,
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            pin_memory=self.pin_memory,
-            persistent_workers=self.persistent_workers,
+            device_id=self.trainer.strategy.root_device.index,
+            num_threads=max(1, self.num_workers),
+            shuffle=True,
+            shard_id=self.trainer.global_rank,
+            num_shards=self.trainer.world_size,
+            # Set on all ranks by `seed_everything`
+            seed=int(os.environ.get("PL_GLOBAL_SEED", 0)),
         )
 
+    def on_before_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        """Decode and transform encoded batches directly on the training device."""
+        if self.gpu_decode:
+            data, targets = batch
+            device = self.trainer.strategy.root_device
+            images = decode_jpeg(
+                data,
+                mode=ImageReadMode.RGB,
+                device=device if device.type == "cuda" else "cpu",
+            )
+            batch = torch.stack([self.transform(image) for image in images]), targets
+        return batch
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        """Resize, normalize to [-1, 1], flip (training only) and convert images to channels-last on the training device."""
+        x, y = batch
+        flip = self._current_split() == "train"
+        return self.device_transform(x, self.img_size, flip), y
+
+    def _current_split(self) -> str:
+        """Return the dataset split matching the running trainer stage."""
+        if self.trainer.training:
+            return "train"
+        if self.trainer.testing:
+            return "test"
+        return "val"
+
     def sanity_check(self):
-        if self.name == "MNIST":
-            assert self.img_channels == 1, "MNIST dataset supports `img_channels=1`."
-        else:
-            assert (
-                self.img_channels == 3
-            ), f"{self.name} dataset supports `img_channels=3`."
+        assert self.name in _DATASET_SPECS, f"Unsupported dataset `{self.name}`."
+        img_channels = _DATASET_SPECS[self.name].img_channels
+        assert (
+            self.img_channels == img_channels
+        ), f"{self.name} dataset supports `img_channels={img_channels}`."
+
+        if self.gpu_decode:
+            assert self.name in (
+                "CelebA",
+                "Flowers102",
+            ), "`gpu_decode=True` is only supported for CelebA and Flowers102 datasets."
+            assert not self.cuda_prefetch, "`gpu_decode=True` already decodes on the GPU, use `cuda_prefetch=False`."
+
+        if self.cache:
+            assert self.name in (
+                "MNIST",
+                "Flowers102",
+            ), "`cache=True` is only supported for MNIST and Flowers102 datasets."
+            assert not self.gpu_decode, "`cache=True` stores decoded images, use `gpu_decode=False`."
+
+        if self.precompute:
+            assert self.name in (
+                "CelebA",
+                "LSUN",
+            ), "`precompute=True` is only supported for CelebA and LSUN datasets."
+            assert not (self.gpu_decode or self.cache), "`precompute=True` can't be combined with `gpu_decode` or `cache`."
+
+        if self.dali:
+            assert self.name == "LSUN", "`dali=True` is only supported for LSUN dataset."
+            assert not self.precompute, "`dali=True` decodes the LMDB images, use `precompute=False`."
@@ -0,0 +1,39 @@
+from typing import Any, List, Sequence, Tuple
+
+import torch
+from torch.utils.data import default_collate
+from torchvision.io import read_file
+
+from codebase.data.shared import SharedCelebA, SharedFlowers102
+
+
+class EncodedCelebA(SharedCelebA):
+    """
+    CelebA dataset that returns the encoded JPEG bytes of each image instead of a decoded PIL image.
+
+    Decoding is deferred to the DataModule, which decodes whole batches on the training device.
+    The `transform` argument is ignored.
+    """
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, Any]:
+        return read_file(self._image_path(index)), self._target(index)
+
+
+class EncodedFlowers102(SharedFlowers102):
+    """
+    Flowers102 dataset that returns the encoded JPEG bytes of each image instead of a decoded PIL image.
+
+    Decoding is deferred to the DataModule, which decodes whole batches on the training device.
+    The `transform` argument is ignored.
+    """
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, Any]:
+        return read_file(self._image_path(idx)), self._target(idx)
+
+
+def encoded_collate(samples: Sequence[Tuple[torch.Tensor, Any]]) -> Tuple[List[torch.Tensor], Any]:
+    """
+    Collate function for encoded datasets.
+
+    The encoded images have different lengths and are kept as a list, while the targets are collated as usual.
+    """
+    data, targets = zip(*samples)
+    return list(data), default_collate(targets)
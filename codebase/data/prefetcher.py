@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Any, Iterator
+
+import torch
+from lightning_fabric.utilities.apply_func import move_data_to_device
+from lightning_utilities.core.apply_func import apply_to_collection
+from torch.utils.data import DataLoader
+
+
+class CudaPrefetcher:
+    """
+    Wraps a DataLoader and copies upcoming batches to the GPU on a side CUDA stream.
+
+    The host-to-device copies of the next `num_prefetch_batches` batches overlap with the computation
+    on the current batch instead of being serialized with it on the default stream. Attributes that are
+    not defined here (e.g. `sampler`, `dataset`, `batch_size`) are looked up on the wrapped DataLoader,
+    so Lightning can still set the sampler epoch.
+    """
+    def __init__(
+        self,
+        dataloader: DataLoader,
+        device: torch.device,
+        num_prefetch_batches: int = 2,
+    ):
+        self.dataloader = dataloader
+        self.device = device
+        self.num_prefetch_batches = num_prefetch_batches
+
+    def __len__(self) -> int:
+        return len(self.dataloader)
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "dataloader":
+            raise AttributeError(name)
+        return getattr(self.dataloader, name)
+
+    def __iter__(self) -> Iterator[Any]:
+        stream = torch.cuda.Stream(device=self.device)
+        batches = deque()
+
+        for batch in self.dataloader:
+            with torch.cuda.stream(stream):
+                batch = move_data_to_device(batch, self.device)
+                copied = torch.cuda.Event()
+                copied.record(stream)
+            batches.append((batch, copied))
+            # Keep `num_prefetch_batches` copies in flight while the oldest batch is consumed
+            if len(batches) > self.num_prefetch_batches:
+                yield self._wait(*batches.popleft())
+
+        while batches:
+            yield self._wait(*batches.popleft())
+
+    def _wait(self, batch: Any, copied: torch.cuda.Event) -> Any:
+        """Make the current stream wait for the copy of `batch` and hand its memory over to it."""
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_event(copied)
+        apply_to_collection(batch, torch.Tensor, lambda t: t.record_stream(current_stream))
+        return batch
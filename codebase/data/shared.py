@@ -0,0 +1,84 @@
+import os
+from typing import Any, Tuple
+
+import numpy as np
+import PIL.Image
+import torch
+from torchvision import datasets
+
+
+class SharedCelebA(datasets.CelebA):
+    """
+    CelebA dataset keeping its metadata in contiguous buffers instead of Python objects.
+
+    The 200K filenames are packed into a single bytes array and the target tensors are moved to shared
+    memory, so DataLoader workers read them without copying (forked workers would otherwise touch the
+    reference counts of every filename string, and spawned workers would receive pickled copies).
+    """
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.filename = np.array(self.filename, dtype=np.bytes_)
+        for tensor in (self.identity, self.bbox, self.landmarks_align, self.attr):
+            tensor.share_memory_()
+
+    def __getitem__(self, index: int) -> Tuple[Any, Any]:
+        image = PIL.Image.open(self._image_path(index))
+        target = self._target(index)
+
+        if self.transform is not None:
+            image = self.transform(image)
+
+        return image, target
+
+    def _image_path(self, index: int) -> str:
+        return os.path.join(self.root, self.base_folder, "img_align_celeba", self.filename[index].decode())
+
+    def _target(self, index: int) -> Any:
+        target: Any = []
+        for t in self.target_type:
+            if t == "attr":
+                target.append(self.attr[index, :])
+            elif t == "identity":
+                target.append(self.identity[index, 0])
+            elif t == "bbox":
+                target.append(self.bbox[index, :])
+            elif t == "landmarks":
+                target.append(self.landmarks_align[index, :])
+            else:
+                raise ValueError(f'Target type "{t}" is not recognized.')
+
+        if not target:
+            return None
+
+        target = tuple(target) if len(target) > 1 else target[0]
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return target
+
+
+class SharedFlowers102(datasets.Flowers102):
+    """
+    Flowers102 dataset keeping its image paths in a single bytes array and its labels in a shared tensor.
+    """
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._image_files = np.array([str(image_file) for image_file in self._image_files], dtype=np.bytes_)
+        self._labels = torch.tensor(self._labels, dtype=torch.long).share_memory_()
+
+    def __getitem__(self, idx: int) -> Tuple[Any, Any]:
+        image = PIL.Image.open(self._image_path(idx)).convert("RGB")
+        label = self._target(idx)
+
+        if self.transform is not None:
+            image = self.transform(image)
+
+        return image, label
+
+    def _image_path(self, idx: int) -> str:
+        return self._image_files[idx].decode()
+
+    def _target(self, idx: int) -> Any:
+        label = self._labels[idx]
+        if self.target_transform is not None:
+            label = self.target_transform(label)
+        return label
@@ -1,4 +1,5 @@
 import sys
+import tempfile
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).parents[1]
@@ -6,3 +7,6 @@ sys.path.append(str(PROJECT_ROOT))
 
 # Dataset
 DATASET_PATH = PROJECT_ROOT / "data" / "dataset"
+
+# RAM disk used to cache preprocessed samples
+CACHE_PATH = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())